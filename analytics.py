@@ -0,0 +1,158 @@
+#coding=utf-8
+import argparse
+import gzip
+import json
+import os
+from multiprocessing import Pool
+
+import numpy as np
+
+"""
+Statistics over the records of finished games, as written by Game.save_record().
+
+Records are streamed from the files and aggregated in chunks, so the memory used
+does not depend on the number of games. Every file is summarized by a separate process.
+
+Usage: python analytics.py games.jsonl [more.jsonl.gz ...]
+"""
+# the same as game.RANK, not imported so the analysis does not need Flask
+RANK = ['A', '2', '3', '4', '5', '6', '7', '8', '9', 'T', 'J', 'Q', 'K']
+
+# columns of a chunk of records
+FIELDS = ['turns', 'pile_draws', 'deck_draws', 'runs', 'books', 'jokers_used']
+CHUNK_SIZE = 10000
+
+
+def read_records(path):
+    """ Read the game records from a file, one at a time
+       Args:
+           path: name of a JSON lines file, may be gzipped
+       Returns:
+           generator of record dicts
+   """
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def read_chunks(records, size=CHUNK_SIZE):
+    """ Group the records into NumPy arrays
+       Args:
+           records: iterable of record dicts
+           size: maximum number of records in a chunk
+       Returns:
+           generator of (counts, jokers) arrays.  counts has a column for every FIELDS value,
+           jokers holds the joker rank of every game, 1 for A to 13 for K and 0 for no joker.
+   """
+    counts = np.zeros((size, len(FIELDS)), dtype=np.int64)
+    jokers = np.zeros(size, dtype=np.int64)
+    n = 0
+    for record in records:
+        counts[n] = [record.get(field, 0) for field in FIELDS]
+        jokers[n] = RANK.index(record['joker']) + 1 if record.get('joker') else 0
+        n += 1
+        if n == size:
+            yield counts, jokers
+            n = 0
+    if n:
+        yield counts[:n], jokers[:n]
+
+
+def new_summary():
+    """ Create an empty summary
+       Args:
+           No args
+       Returns:
+           summary dict
+   """
+    return {'games': 0,
+            'totals': np.zeros(len(FIELDS), dtype=np.int64),
+            'joker_games': np.zeros(len(RANK) + 1, dtype=np.int64),
+            'joker_used': np.zeros(len(RANK) + 1, dtype=np.int64)}
+
+
+def summarize_file(path):
+    """ Summarize all the game records of a file
+       Args:
+           path: name of the file
+       Returns:
+           summary dict
+   """
+    summary = new_summary()
+    for counts, jokers in read_chunks(read_records(path)):
+        summary['games'] += len(counts)
+        summary['totals'] += counts.sum(axis=0)
+        summary['joker_games'] += np.bincount(jokers, minlength=len(RANK) + 1)
+        summary['joker_used'] += np.bincount(jokers, weights=counts[:, FIELDS.index('jokers_used')],
+                                             minlength=len(RANK) + 1).astype(np.int64)
+    return summary
+
+
+def merge_summaries(summaries):
+    """ Add up the summaries of several files
+       Args:
+           summaries: iterable of summary dicts
+       Returns:
+           summary dict
+   """
+    total = new_summary()
+    for summary in summaries:
+        for key in total:
+            total[key] += summary[key]
+    return total
+
+
+def summarize(paths, processes=None):
+    """ Summarize the game records of all files, a process per file
+       Args:
+           paths: list of file names
+           processes: number of processes, the number of CPUs if None
+       Returns:
+           summary dict
+   """
+    if len(paths) == 1:
+        return summarize_file(paths[0])
+    with Pool(processes or os.cpu_count()) as pool:
+        return merge_summaries(pool.imap_unordered(summarize_file, paths))
+
+
+def report(summary):
+    """ Make a displayable report of a summary
+       Args:
+           summary: summary dict
+       Returns:
+           report string
+   """
+    games = summary['games']
+    if games == 0:
+        return "No games."
+    totals = dict(zip(FIELDS, summary['totals'].tolist()))
+    draws = totals['pile_draws'] + totals['deck_draws']
+    melds = totals['runs'] + totals['books']
+
+    s = "Games: %d" % games
+    s += "\nAverage turns to close: %.2f" % (totals['turns'] / games)
+    if draws:
+        s += "\nDraws from pile: %.1f%%, from deck: %.1f%%" % (100.0 * totals['pile_draws'] / draws,
+                                                             100.0 * totals['deck_draws'] / draws)
+    if melds:
+        s += "\nRuns: %d (%.1f%%), books: %d (%.1f%%)" % (totals['runs'], 100.0 * totals['runs'] / melds,
+                                                          totals['books'], 100.0 * totals['books'] / melds)
+    s += "\nGames without joker: %d" % summary['joker_games'][0]
+    for i, rank in enumerate(RANK):
+        joker_games = summary['joker_games'][i + 1]
+        if joker_games:
+            s += "\nJoker %s: %d games, %.2f jokers used per game" % (rank, joker_games,
+                                                                      summary['joker_used'][i + 1] / joker_games)
+    return s
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Statistics over recorded Rummy games.')
+    parser.add_argument('files', nargs='+', help='JSON lines files written by the game, may be gzipped')
+    parser.add_argument('--processes', type=int, default=None, help='number of processes, default is number of CPUs')
+    args = parser.parse_args()
+    print(report(summarize(args.files, args.processes)))
@@ -0,0 +1,187 @@
+#coding=utf-8
+import asyncio
+import json
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi
+
+import game
+
+"""
+asyncio serving mode for the game.
+
+Players waiting for a turn in /wait_turn are parked on a per-game asyncio.Event
+instead of holding a thread each.  All other routes are the Flask routes of game.py,
+run by WsgiToAsgi on its executor thread, so rendering and meld solving never block
+the event loop and the engine is still used from one thread at a time.
+Spectators of /spectate get the already serialized snapshot of the Game straight
+from the event loop, only the first request after a change goes to Flask.
+Snapshots of tournament tables are read from their files once per change and
+served from the event loop too.
+
+Needs asgiref and an ASGI server such as uvicorn (see requirements.txt).
+Run with, for example:
+    uvicorn asgi:app --host 0.0.0.0 --port 5011
+and compare with the threaded mode (python game.py) using load_wait.py.
+"""
+flask_app = WsgiToAsgi(game.app)
+
+loop = None
+game_events = {}  # game id -> [asyncio.Event set on the next change of the Game, number of waiting players]
+
+
+def notify(game_id):
+    """ Wake up all players waiting for a change of the Game
+   Args:
+       game_id: id of the Game - string
+   Returns:
+       No returns
+   """
+    waiting = game_events.pop(game_id, None)
+    if waiting:
+        waiting[0].set()
+
+
+def on_change(g):
+    """ Listener for Game.bump_version, called from the executor thread
+   Args:
+       g: the Game that changed
+   Returns:
+       No returns
+   """
+    if loop:
+        loop.call_soon_threadsafe(notify, g.id)
+
+
+game.version_listeners.append(on_change)
+
+
+async def send_json(send, data, status=200):
+    """ Send a JSON response
+   Args:
+       send: ASGI send function
+       data: value to be sent as JSON
+       status: HTTP status code
+   Returns:
+       No returns
+   """
+    body = json.dumps(data).encode('utf-8')
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def wait_turn(scope, receive, send):
+    """ Wait until the Game changes from the version the player has seen
+   Args:
+       scope, receive, send: ASGI arguments
+   Returns:
+       No returns
+   """
+    g = getattr(game, 'g', None)
+    if g is None:
+        await send_json(send, {'error': 'no game'}, 404)
+        return
+
+    query = parse_qs(scope.get('query_string', b'').decode())
+    try:
+        version = int(query['version'][0])
+    except (KeyError, ValueError):
+        version = None
+
+    if g.version == version:
+        waiting = game_events.setdefault(g.id, [asyncio.Event(), 0])
+        waiting[1] += 1
+        try:
+            await asyncio.wait_for(waiting[0].wait(), game.WAIT_TIMEOUT)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            # The last player to time out removes the event of a Game that did not change
+            waiting[1] -= 1
+            if waiting[1] == 0 and game_events.get(g.id) is waiting:
+                del game_events[g.id]
+
+    await send_json(send, {'version': g.version, 'name': getattr(game, 'name', None)})
+
+
+async def spectate(scope, receive, send):
+    """ Serve the public snapshot of a Game if it is already serialized for the current version,
+   or the snapshot file of a tournament table
+   Args:
+       scope, receive, send: ASGI arguments
+   Returns:
+       True if the response was sent, False if the snapshot needs to be made by the Flask route
+   """
+    query = parse_qs(scope.get('query_string', b'').decode())
+    if 'game' in query:
+        game_id = query['game'][0]
+        g = game.live_games.get(game_id)
+    else:
+        g = getattr(game, 'g', None)
+        game_id = g.id if g is not None else None
+
+    if g is not None:
+        # A Game of this process - only a snapshot already made by Flask, the engine runs on its thread
+        snapshot = g.snapshot
+        if snapshot is None or snapshot[0] != g.version:
+            return False
+    elif game_id is not None:
+        # A tournament table played by another process - the file snapshot cached by game.py
+        snapshot = game.find_snapshot(game_id)
+        if snapshot is None:
+            return False
+    else:
+        return False
+
+    etag = ('"%s-%s"' % (game_id, snapshot[0])).encode()
+    headers = dict(scope.get('headers', []))
+    if headers.get(b'if-none-match') == etag:
+        await send({'type': 'http.response.start', 'status': 304, 'headers': [(b'etag', etag)]})
+        await send({'type': 'http.response.body', 'body': b''})
+        return True
+
+    await send({'type': 'http.response.start', 'status': 200,
+                'headers': [(b'content-type', b'application/json'), (b'etag', etag),
+                            (b'content-length', str(len(snapshot[1])).encode())]})
+    await send({'type': 'http.response.body', 'body': snapshot[1]})
+    return True
+
+
+async def lifespan(scope, receive, send):
+    """ Handle the ASGI lifespan protocol, remembering the event loop on startup
+   Args:
+       scope, receive, send: ASGI arguments
+   Returns:
+       No returns
+   """
+    global loop
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            loop = asyncio.get_running_loop()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    """ ASGI application
+   Args:
+       scope, receive, send: ASGI arguments
+   Returns:
+       No returns
+   """
+    global loop
+    if scope['type'] == 'lifespan':
+        await lifespan(scope, receive, send)
+        return
+
+    loop = asyncio.get_running_loop()
+    if scope['type'] == 'http' and scope['path'] == '/wait_turn':
+        await wait_turn(scope, receive, send)
+    elif scope['type'] == 'http' and scope['path'] == '/spectate' and await spectate(scope, receive, send):
+        pass
+    else:
+        await flask_app(scope, receive, send)
@@ -1,6 +1,13 @@
 #coding=utf-8
-from flask import Flask, render_template, session, request, redirect, url_for
-from collections import OrderedDict
+import hashlib
+import json
+import os
+import threading
+import uuid
+import weakref
+from flask import Flask, render_template, session, request, redirect, url_for, make_response, jsonify
+from collections import OrderedDict, Counter
+from functools import lru_cache
 app = Flask(__name__)
 app.secret_key = "super secret key"
 
@@ -33,6 +40,31 @@ RANK_VALUE = {'A': 1, '2': 2, '3': 3, '4': 4, '5': 5, '6': 6, '7': 7, '8': 8, '9
               'K': 13}
 SUIT_SYMBOLS = {'Hearts': 'H', 'Clubs': 'C', 'Spades': 'S', 'Diamonds': 'D'}
 
+# limits for the rendered page cache
+RENDER_CACHE_ENTRIES = 256
+RENDER_CACHE_SIZE = 8 * 1024 * 1024
+
+# finished games are appended here, one JSON record per line
+GAMES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'games.jsonl')
+
+# snapshots of the Games played by other processes (tournament bots), one file per Game
+SPECTATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'spectate')
+
+# seconds a player waits in /wait_turn before getting the unchanged state back
+WAIT_TIMEOUT = 30
+
+# notified on every change of a Game, for players waiting in /wait_turn
+turn_changed = threading.Condition()
+# functions called with the Game on every change, used by the asyncio serving mode
+version_listeners = []
+# the Tournament of the web server, started from /tournament
+current_tournament = None
+
+# Games of this process by id, for spectators.  A finished Game goes away with its last reference.
+live_games = weakref.WeakValueDictionary()
+# game id -> (modification time, JSON bytes) of the snapshot files, read once per change
+file_snapshots = {}
+
 
 class Card:
     """ Card Class - Models a single Playing Card """
@@ -131,6 +163,101 @@ class Deck:
                 card.isjoker = True
 
 
+class RenderCache:
+    """ RenderCache Class - Keeps rendered game pages between state changes """
+
+    def __init__(self, max_entries=RENDER_CACHE_ENTRIES, max_size=RENDER_CACHE_SIZE):
+        """ Class Constructor
+      Args:
+          max_entries: Maximum number of pages kept in the cache - int value
+          max_size: Maximum total length of the pages kept in the cache - int value
+      Returns:
+          No return value
+      """
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.pages = OrderedDict()
+        self.game_keys = {}  # game id -> set of the keys of its pages
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()  # requests are served by many threads
+
+    def get(self, key):
+        """ Get a rendered page and mark it as recently used
+      Args:
+          key: (game id, state version, player name, template) tuple
+      Returns:
+          the rendered page or None if it is not in the cache
+      """
+        with self.lock:
+            page = self.pages.get(key)
+            if page is None:
+                self.misses += 1
+                return None
+            self.pages.move_to_end(key)
+            self.hits += 1
+            return page
+
+    def put(self, key, page):
+        """ Store a rendered page, evicting the least recently used ones over the limits
+      Args:
+          key: (game id, state version, player name, template) tuple
+          page: the rendered page - string
+      Returns:
+          No returns
+      """
+        if len(page) > self.max_size:
+            return
+        with self.lock:
+            self.remove(key)
+            self.pages[key] = page
+            self.game_keys.setdefault(key[0], set()).add(key)
+            self.size += len(page)
+            while len(self.pages) > self.max_entries or self.size > self.max_size:
+                self.remove(next(iter(self.pages)))
+
+    def remove(self, key):
+        """ Remove a page, the lock must be held
+      Args:
+          key: (game id, state version, player name, template) tuple
+      Returns:
+          No returns
+      """
+        page = self.pages.pop(key, None)
+        if page is None:
+            return
+        self.size -= len(page)
+        keys = self.game_keys[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self.game_keys[key[0]]
+
+    def invalidate(self, game_id):
+        """ Remove all pages of a Game, used when the state of the Game changes
+      Args:
+          game_id: id of the Game - string
+      Returns:
+          No returns
+      """
+        with self.lock:
+            for key in list(self.game_keys.get(game_id, ())):
+                self.remove(key)
+
+    def stats(self):
+        """ Cache counters
+      Args:
+          No args
+      Returns:
+          dict with hits, misses, number of entries and total size
+      """
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.pages), 'size': self.size}
+
+
+render_cache = RenderCache()
+
+
 class Table:
     def __init__(self):
         self.stash = []
@@ -219,8 +346,7 @@ class Player:
 
         # Check if each of the sets is either a run or a book
         print(print_cards(set_array))
-        if is_valid_run(set_array) == False and is_valid_book(set_array) == False and is_valid_run_joker(
-                set_array) == False:
+        if is_valid_run_joker(set_array) == False and is_valid_book(set_array) == False:
             return False
 
         # return True
@@ -243,6 +369,7 @@ class Player:
         table_stash = self.table.stash
         global name
         name = self.name
+        self.game.turn = self.name
         global self_stash
         self_stash = self.stash
         global len_table_stash
@@ -251,6 +378,9 @@ class Player:
         len_self_stash = len(self.stash)
         pile = self_pile[0]
 
+        # The turn has passed - wake up the players waiting for it with the new name
+        self.game.bump_version()
+
 
 class Game:
     """ Game Class - Models a single Game """
@@ -258,19 +388,34 @@ class Game:
     global self_pile
     self_pile = []
 
-    def __init__(self, hands, deck, table):
+    def __init__(self, hands, deck, table, names=None):
         """ Class Constructor
           Args:
               hands:  represents the number of players in the game - an int
               deck: Reference to Deck Object
+              names: names of the Players, read from the players form if not given
           Returns:
               No returns
       """
+        # unique across restarts and processes, so ETags of an old Game never match a new one
+        self.id = uuid.uuid4().hex
+        live_games[self.id] = self
+        self.version = 0
         self.players = []
         self.table = table
-        print(hands)
+        self.deck = deck
+        self.finished = False
+        self.turn = None  # name of the Player whose turn it is
+        self.advisors = {}  # player name -> DiscardAdvisor
+        self.snapshot = None  # (version, JSON bytes) of the public state, shared by all spectators
+        self.tournament = None  # the Tournament of a tournament table
+        self.tournament_table = None  # table id in the Tournament
+        self.record = {'turns': 0, 'pile_draws': 0, 'deck_draws': 0, 'runs': 0, 'books': 0, 'jokers_used': 0}
         for i in range(hands):
-            name = request.form.get('player-name-'+str(i+1))
+            if names:
+                name = names[i]
+            else:
+                name = request.form.get('player-name-'+str(i+1))
             self.players.append(Player(name, deck, self, table))
 
     def display_pile(self):
@@ -285,6 +430,98 @@ class Game:
         else:
             print("The card at the top of the pile is: ", self_pile[0])
 
+    def bump_version(self):
+        """ Mark the state of the Game as changed, so cached pages are not served anymore
+          and the players waiting for a change are woken up.
+          Args:
+              No args
+          Returns:
+              No returns
+      """
+        self.version += 1
+        render_cache.invalidate(self.id)
+        with turn_changed:
+            turn_changed.notify_all()
+        for listener in version_listeners:
+            listener(self)
+
+    def public_snapshot(self):
+        """ The public state of the Game as seen by spectators, serialized once per version.
+          Args:
+              No args
+          Returns:
+              (version, JSON bytes) tuple, the same bytes object until the Game changes
+      """
+        if self.snapshot is None or self.snapshot[0] != self.version:
+            state = {'game': self.id,
+                     'version': self.version,
+                     'turn': self.turn,
+                     'table': [[str(card) for card in cards if card] for cards in self.table.stash],
+                     'pile': str(self_pile[0]) if self_pile else None,
+                     'hands': [{'name': player.name, 'cards': len(player.stash)} for player in self.players]}
+            self.snapshot = (self.version, json.dumps(state).encode('utf-8'))
+        return self.snapshot
+
+    def publish_snapshot(self, directory=SPECTATE_DIR):
+        """ Write the public snapshot to a file, so the Game can be watched from the web server
+          when it is played by another process.
+          Args:
+              directory: directory of the snapshot files
+          Returns:
+              No returns
+      """
+        version, snapshot = self.public_snapshot()
+        path = os.path.join(directory, self.id + '.json')
+        with open(path + '.tmp', 'wb') as f:
+            f.write(snapshot)
+        os.replace(path + '.tmp', path)
+
+    def unpublish_snapshot(self, directory=SPECTATE_DIR):
+        """ Remove the snapshot file of a finished Game.
+          Args:
+              directory: directory of the snapshot files
+          Returns:
+              No returns
+      """
+        try:
+            os.remove(os.path.join(directory, self.id + '.json'))
+        except OSError:
+            pass
+
+    def record_meld(self, cards):
+        """ Count a set put on the table in the record of the Game.
+          Args:
+              cards: array of Card objects - a valid run or book
+          Returns:
+              No returns
+      """
+        if solve_run(cards) is not None:
+            self.record['runs'] += 1
+        else:
+            self.record['books'] += 1
+        for card in cards:
+            if card.is_joker():
+                self.record['jokers_used'] += 1
+
+    def save_record(self, winner):
+        """ Append the record of the finished Game to the GAMES_FILE, once per Game.
+          Args:
+              winner: name of the Player who won the Game
+          Returns:
+              No returns
+      """
+        # A repeated close of the same Game is not recorded again
+        if self.finished:
+            return
+        self.finished = True
+
+        record = dict(self.record)
+        record['players'] = len(self.players)
+        record['winner'] = winner
+        record['joker'] = self.deck.joker.rank if self.deck.joker else None
+        with open(GAMES_FILE, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
     def add_pile(self, card):
         """ Adds card to the top of the Pile.
           Args:
@@ -293,6 +530,19 @@ class Game:
               No returns
       """
         self_pile.insert(0, card)
+        self.bump_version()
+
+    def reshuffle_pile(self):
+        """ Put the Pile, except its top card, back into the empty Deck and shuffle it.
+          Args:
+              No args
+          Returns:
+              No returns
+      """
+        self.deck.cards += self_pile[1:]
+        del self_pile[1:]
+        self.deck.shuffle()
+        self.bump_version()
 
     def draw_pile(self):
         """ Draw the top card from the Pile.
@@ -302,7 +552,9 @@ class Game:
               Returns the top Card from the Pile - Card Object
       """
         if len(self_pile) != 0:
-            return self_pile.pop(0)
+            card = self_pile.pop(0)
+            self.bump_version()
+            return card
         else:
             return None
 
@@ -327,155 +579,351 @@ class Game:
         print("*** ", self.players[i].name, " Won the game ***")
 
 
+class DiscardAdvisor:
+    """ DiscardAdvisor Class - Ranks the possible discards of a Player's hand by their outs
+
+    An out is an unseen card that makes a valid set of 3 together with two cards of the hand.
+    The pairs of the hand are kept in the completions counter, so a single card change
+    in the hand only needs the pairs with that card to be updated.
+    """
+
+    def __init__(self):
+        """ Class Constructor
+      Args:
+          No args
+      Returns:
+          No return value
+      """
+        self.hand = Counter()  # (rank, suit) of the cards in the hand
+        self.completions = Counter()  # (rank, suit) completing a pair of the hand -> number of pairs
+        self.version = None
+        self.advice = None
+
+    def add_card(self, kind):
+        """ Add a card to the hand and count the sets it can be completed to
+      Args:
+          kind: (rank, suit) of the card
+      Returns:
+          No returns
+      """
+        for other in self.hand.elements():
+            self.completions.update(completing_kinds(kind, other))
+        self.hand[kind] += 1
+
+    def remove_card(self, kind):
+        """ Remove a card from the hand and forget the sets it could be completed to
+      Args:
+          kind: (rank, suit) of the card
+      Returns:
+          No returns
+      """
+        self.hand[kind] -= 1
+        if self.hand[kind] == 0:
+            del self.hand[kind]
+        for other in self.hand.elements():
+            self.completions.subtract(completing_kinds(kind, other))
+        self.completions += Counter()  # drop the pairs that are gone
+
+    def sync(self, stash):
+        """ Update the hand to match the stash of the Player, card by card
+      Args:
+          stash: array of Card objects
+      Returns:
+          No returns
+      """
+        current = Counter(card_kind(card) for card in stash)
+        for kind in (self.hand - current).elements():
+            self.remove_card(kind)
+        for kind in (current - self.hand).elements():
+            self.add_card(kind)
+
+    def outs(self, kind, unseen):
+        """ Count the outs of the hand left after discarding a card
+      Args:
+          kind: (rank, suit) of the discarded card
+          unseen: Counter of (rank, suit) of the cards not seen by the Player
+      Returns:
+          number of unseen cards that complete a set - int value
+      """
+        lost = Counter()
+        for other, count in self.hand.items():
+            if other == kind:
+                count -= 1
+            for i in range(count):
+                lost.update(completing_kinds(kind, other))
+        return sum(unseen[k] for k, n in self.completions.items() if n > lost[k])
+
+    def rank_discards(self, stash, unseen, version):
+        """ Rank all the possible discards, best first
+      Args:
+          stash: array of Card objects - the hand of the Player
+          unseen: Counter of (rank, suit) of the cards not seen by the Player
+          version: version of the Game the unseen cards were counted at
+      Returns:
+          list of (card, outs) tuples sorted by outs
+      """
+        if version is not None and version == self.version:
+            return self.advice
+
+        self.sync(stash)
+        outs = {}
+        for kind in self.hand:
+            outs[kind] = self.outs(kind, unseen)
+        advice = [(str(card), outs[card_kind(card)]) for card in stash]
+        advice.sort(key=lambda item: item[1], reverse=True)
+
+        self.version = version
+        self.advice = advice
+        return advice
+
+
 # global nonclass functions
-def is_valid_book(sequence):
-    """ Check if the sequence is a valid book.
+def card_kind(card):
+    """ Get the (rank, suit) of a Card, the same for all packs
        Args:
-           sequence: an array of Card objects.  Array will have either 3 ro 4 cards
+           card: Card object
        Returns:
-           Success or Failure as True/False
+           (rank, suit) tuple
    """
-    # Move all Jokers to the end of the sequence
-    # while(sequence[0].isjoker == True):
-    #	sequence.append(sequence.pop(0))
-
-    # Compare Cards in sequnce with 0th Card, except for Jokers.
-    # for card in sequence:
-    #	if card.is_joker() == True:
-    #		continue
-    #	if card.rank != sequence[0].rank:
-    #		return False
-
-    if (len(sequence)<3):
-        return False
+    return (card.rank, card.suit)
+
+
+def rank_from_value(value):
+    """ Get the RANK for a value from 1 to 14, both 1 and 14 being Ace
+       Args:
+           value: int value
+       Returns:
+           RANK value or None if out of range
+   """
+    if value < 1 or value > 14:
+        return None
+    return RANK[(value - 1) % 13]
 
 
+@lru_cache(maxsize=None)
+def completing_kinds(first, second):
+    """ Find the cards which make a valid set of 3 with the two given cards
+       Args:
+           first: (rank, suit) of the first card
+           second: (rank, suit) of the second card
+       Returns:
+           tuple of (rank, suit) of the completing cards
+   """
+    kinds = set()
+
+    # Book - same rank, all suits different
+    if first[0] == second[0] and first[1] != second[1]:
+        for s in SUIT:
+            if s != first[1] and s != second[1]:
+                kinds.add((first[0], s))
+
+    # Run - same suit, Ace can be low or high
+    if first[1] == second[1] and first[0] != second[0]:
+        for a in (1, 14) if first[0] == 'A' else (RANK.index(first[0]) + 1,):
+            for b in (1, 14) if second[0] == 'A' else (RANK.index(second[0]) + 1,):
+                low, high = min(a, b), max(a, b)
+                if high - low == 1:
+                    values = [low - 1, high + 1]
+                elif high - low == 2:
+                    values = [low + 1]
+                else:
+                    values = []
+                for v in values:
+                    if rank_from_value(v):
+                        kinds.add((rank_from_value(v), first[1]))
 
-    for i in range(1, len(sequence)):
-        # print(RANK_VALUE[sequence[i].rank])
-        # print( RANK_VALUE[(sequence[i-1].rank)])
-        print('spr:')
-        print(sequence[i])
-        print(RANK_VALUE[sequence[i].rank])
+    return tuple(kinds)
 
-        for x in range(0, len(sequence)):
-            if sequence[i].suit == sequence[x].suit and i != x:
-                return False
 
-        if RANK_VALUE[sequence[i].rank] != RANK_VALUE[(sequence[i - 1].rank)]:
-            # print('not equal')
-            return False
+def unseen_cards(packs, stash, pile, table_stash):
+    """ Count the cards the Player has not seen yet
+       Args:
+           packs: Number of packs in the Deck - int value
+           stash: array of Card objects - the hand of the Player
+           pile: array of Card objects - the Pile
+           table_stash: array of sets of Card objects put on the table
+       Returns:
+           Counter of (rank, suit) of the unseen cards
+   """
+    unseen = Counter()
+    for s in SUIT:
+        for r in RANK:
+            unseen[(r, s)] = packs
+    for card in stash + pile:
+        unseen[card_kind(card)] -= 1
+    for cards in table_stash:
+        for card in cards:
+            unseen[card_kind(card)] -= 1
+    return unseen
 
-    return True
+
+def is_valid_book(sequence):
+    """ Check if the sequence is a valid book, Jokers stand for the missing suits.
+       Args:
+           sequence: an array of Card objects.  Array will have either 3 ro 4 cards
+       Returns:
+           Success or Failure as True/False
+   """
+    return solve_book(sequence) is not None
 
 
 def is_valid_run(sequence):
-    """ Check if the sequence is a valid run.
+    """ Check if the sequence is a valid run without Jokers.
+       The sequence is put in the order of the run.
        Args:
            sequence: an array of Card objects.  Array will have either 3 ro 4 cards
        Returns:
            Success or Failure as True/False
    """
-    if (len(sequence)<3):
-        return False
-
-    RANK_VALUE["A"] = 1  # resetting value of A (may have been set to 14 in previous run)
-
-    # Order the Cards in the sequence
-    sort_sequence(sequence)
-
-    # Check to see if all Cards in the sequence have the same SUIT
-    # for card in sequence:
-    #	if card.suit != sequence[0].suit:
-    #		return False
-
-    # this is to sort a sequence that has K, Q and A
-    if sequence[0].rank == "A":
-        if sequence[1].rank == "Q" or sequence[1].rank == "J" or sequence[1].rank == "K":
-            RANK_VALUE[sequence[0].rank] = 14
-            sort_sequence(sequence)
-
-    # Rank Comparison
-    for i in range(1, len(sequence)):
-        for x in range(0, len(sequence)):
-            if sequence[i].suit != sequence[x].suit and i != x:
-                return False
-        if RANK_VALUE[sequence[i].rank] != RANK_VALUE[(sequence[i - 1].rank)] + 1:
-            # print('są nie pokolei')
+    for card in sequence:
+        if card.is_joker():
             return False
-
-    return True
+    return is_valid_run_joker(sequence)
 
 
 def is_valid_run_joker(sequence):
     """ Check if the sequence with Jokers is a valid run.
+       The sequence is reordered so that every Joker is at the place of the card it stands for.
        Args:
            sequence: an array of Card objects.  Array will have either 3 ro 4 cards
        Returns:
            Success or Failure as True/False
    """
+    solution = solve_run(sequence)
+    if solution is None:
+        return False
 
-    RANK_VALUE["A"] = 1  # resetting value of A (may have been set to 14 in previous run)
+    sequence[:] = [card for card, rank, suit in solution]
+    return True
 
-    # Order the Cards in the sequence
-    sort_sequence(sequence)
 
-    # Push all Jokers to the end and count the number of Jokers
-    push_joker_toend(sequence)
-    joker_count = 0
-    for card in sequence:
-        if card.is_joker() == True:
-            joker_count += 1
+def run_values(rank):
+    """ Values a RANK can take in a run, Ace is both before 2 and after K
+       Args:
+           rank: RANK value
+       Returns:
+           tuple of values from 1 to 14
+   """
+    if rank == 'A':
+        return (1, 14)
+    return (RANK.index(rank) + 1,)
+
+
+def make_run_table():
+    """ Precompute the gaps of every set of run values
+       Args:
+           No args
+       Returns:
+           list indexed by the bit mask of values 1 to 14 (bit 0 is value 1),
+           of (lowest value, highest value, number of values, number of gaps) tuples
+   """
+    table = [(0, 0, 0, 0)]
+    for mask in range(1, 1 << 14):
+        values = [v + 1 for v in range(14) if mask & (1 << v)]
+        low, high = values[0], values[-1]
+        table.append((low, high, len(values), high - low + 1 - len(values)))
+    return table
 
-    # Make sure the Suit Match except for Jokers.
-    for card in sequence:
-        if card.is_joker() == True:
-            continue
-        if card.suit != sequence[0].suit:
-            return False
 
-    # This is to cover for K, Q and A run with Jokers
-    if sequence[0].rank == "A":
-        if sequence[1].rank == "Q" or sequence[1].rank == "J" or sequence[1].rank == "K":
-            RANK_VALUE[sequence[0].rank] = 14
-            sort_sequence(sequence)
-            push_joker_toend(sequence)
+RUN_TABLE = make_run_table()
 
-    rank_inc = 1
-    for i in range(1, len(sequence)):
-        if sequence[i].is_joker() == True:
+
+def solve_run(sequence):
+    """ Find the run made by the sequence, with any number of Jokers in any position.
+       Args:
+           sequence: an array of Card objects
+       Returns:
+           array of (card, rank, suit) tuples in the order of the run, with the rank and suit
+           each Joker stands for, or None if the sequence is not a valid run
+   """
+    length = len(sequence)
+    if length < 3 or length > 14:
+        return None
+
+    jokers = [card for card in sequence if card.is_joker()]
+    naturals = [card for card in sequence if not card.is_joker()]
+    suit = naturals[0].suit if naturals else jokers[0].suit
+    for card in naturals:
+        if card.suit != suit:
+            return None
+
+    # Try Ace as 1 first, then as 14
+    for ace in (0, 1):
+        mask = 0
+        for card in naturals:
+            values = run_values(card.rank)
+            mask |= 1 << (values[ace if len(values) > 1 else 0] - 1)
+
+        low, high, count, gaps = RUN_TABLE[mask]
+        if count != len(naturals):
+            return None  # the same rank twice
+        if count and high - low + 1 > length:
+            continue
+        if gaps > len(jokers):
             continue
-        # Compare RANK values with accomodating for Jokers.
-        while (RANK_VALUE[sequence[i].rank] != RANK_VALUE[(sequence[i - 1].rank)] + rank_inc):
-            # Use Joker Count for missing Cards in the run
-            if joker_count > 0:
-                rank_inc += 1
-                joker_count -= 1
-                continue
+
+        # Place the run so it covers all the cards and does not go past Ace
+        first = min(low, 15 - length) if count else 1
+        by_value = {}
+        for card in naturals:
+            values = run_values(card.rank)
+            by_value[values[ace if len(values) > 1 else 0]] = card
+        solution = []
+        free_jokers = list(jokers)
+        for value in range(first, first + length):
+            rank = RANK[(value - 1) % 13]
+            if value in by_value:
+                solution.append((by_value[value], rank, suit))
             else:
-                # if No more Jokers left, then revert to regular comparison
-                if RANK_VALUE[sequence[i].rank] != RANK_VALUE[(sequence[i - 1].rank)] + 1:
-                    return False
-                else:
-                    break
-    return True
+                solution.append((free_jokers.pop(0), rank, suit))
+        return solution
 
+    return None
 
-def push_joker_toend(sequence):
-    """ Push the Joker to the end of the sequence.
+
+def solve_book(sequence):
+    """ Find the book made by the sequence, with any number of Jokers in any position.
        Args:
-           sequence: sequence of Card Objects.
+           sequence: an array of Card objects
        Returns:
-           no return
+           array of (card, rank, suit) tuples, with the rank and suit each Joker stands for,
+           or None if the sequence is not a valid book
    """
-    sort_sequence(sequence)
-    joker_list = []
+    if len(sequence) < 3 or len(sequence) > len(SUIT):
+        return None
+
+    naturals = [card for card in sequence if not card.is_joker()]
+    rank = naturals[0].rank if naturals else sequence[0].rank
+    suits = set()
+    for card in naturals:
+        if card.rank != rank or card.suit in suits:
+            return None
+        suits.add(card.suit)
+
+    missing = [s for s in SUIT if s not in suits]
+    solution = []
     for card in sequence:
-        if card.is_joker() == True:
-            sequence.remove(card)
-            joker_list.append(card)
-    sequence += joker_list
-    return sequence
+        if card.is_joker():
+            solution.append((card, rank, missing.pop(0)))
+        else:
+            solution.append((card, card.rank, card.suit))
+    return solution
+
+
+def solve_meld(sequence):
+    """ Find the meld made by the sequence and what each Joker stands for.
+       Args:
+           sequence: an array of Card objects
+       Returns:
+           ('run' or 'book', array of (card, rank, suit) tuples) or None if the sequence is not a valid set
+   """
+    solution = solve_run(sequence)
+    if solution is not None:
+        return ('run', solution)
+    solution = solve_book(sequence)
+    if solution is not None:
+        return ('book', solution)
+    return None
 
 
 def get_object(arr, str_card):
@@ -532,6 +980,86 @@ def sort_sequence(sequence):
     return sequence
 
 
+def is_game_id(game_id):
+    """ Check if the string is a Game id, so it is safe to use in a file name
+       Args:
+           game_id: string
+       Returns:
+           True or False
+   """
+    return len(game_id) == 32 and all(c in '0123456789abcdef' for c in game_id)
+
+
+def published_games(directory=SPECTATE_DIR):
+    """ Ids of the Games with a snapshot file, played by other processes
+       Args:
+           directory: directory of the snapshot files
+       Returns:
+           list of Game ids
+   """
+    if not os.path.isdir(directory):
+        return []
+    ids = [f[:-5] for f in os.listdir(directory) if f.endswith('.json') and is_game_id(f[:-5])]
+
+    # Forget the cached snapshots of the finished Games
+    for game_id in set(file_snapshots) - set(ids):
+        file_snapshots.pop(game_id, None)
+    return ids
+
+
+def find_snapshot(game_id, directory=SPECTATE_DIR):
+    """ Find the public snapshot of a Game of this process or of a snapshot file
+       Args:
+           game_id: id of the Game - string
+           directory: directory of the snapshot files
+       Returns:
+           (version, JSON bytes) tuple or None if there is no such Game.
+           For a file the version is its modification time.
+   """
+    live = live_games.get(game_id)
+    if live is not None:
+        return live.public_snapshot()
+
+    if not is_game_id(game_id):
+        return None
+    path = os.path.join(directory, game_id + '.json')
+    try:
+        modified = os.stat(path).st_mtime_ns
+    except OSError:
+        file_snapshots.pop(game_id, None)
+        return None
+
+    # All spectators share the bytes read after the last change of the file
+    snapshot = file_snapshots.get(game_id)
+    if snapshot is None or snapshot[0] != modified:
+        try:
+            with open(path, 'rb') as f:
+                snapshot = (os.fstat(f.fileno()).st_mtime_ns, f.read())
+        except OSError:
+            return None
+        file_snapshots[game_id] = snapshot
+    return snapshot
+
+
+def render_game(template, **context):
+    """ Render a game page, reusing the cached page if the Game did not change
+       Args:
+           template: name of the template file
+           context: variables passed to the template
+       Returns:
+           Response with ETag, 304 Not Modified if the client has the current page
+   """
+    key = (g.id, g.version, name, template)
+    page = render_cache.get(key)
+    if page is None:
+        page = render_template(template, **context)
+        render_cache.put(key, page)
+
+    response = make_response(page)
+    response.set_etag(hashlib.sha1(repr(key).encode('utf-8')).hexdigest())
+    return response.make_conditional(request)
+
+
 
 @app.route("/")
 def index():
@@ -551,10 +1079,17 @@ def settings():
     who_is_playing = request.form.get('number_of_people')
     return render_template('settings.htm', number_of_people=number_of_people)
 
-@app.route("/take_card", methods=['GET','POST'])
-def main():
-    """ Main Program """
-    #return render_template('play_game.htm')
+def start_game(names=None, table_id=None):
+    """ Start a new Game and let the Players begin
+   Args:
+       names: names of the Players, read from the players form if not given
+       table_id: table id in the current_tournament for a tournament table
+   Returns:
+       No returns
+   """
+    global number_of_people
+    if names:
+        number_of_people = len(names)
 
     # Create Deck with 2 Packs
     global deck
@@ -568,9 +1103,14 @@ def main():
     global table
     table = Table()
     global g
-    g = Game(int(number_of_people), deck, table)
+    g = Game(int(number_of_people), deck, table, names)
+    if table_id is not None:
+        g.tournament = current_tournament
+        g.tournament_table = table_id
     global len_run
     len_run = []
+    # The Pile of the previous Game is not used anymore
+    del self_pile[:]
 
     # Deal Cards
     for i in range(13):
@@ -585,7 +1125,53 @@ def main():
     # Now let the Players begin
     g.play()
 
-    return render_template('take_a_card.htm', table_stash=table_stash, name=name, self_stash=self_stash,
+
+def play_bot_turns():
+    """ Play the turns of the bots at a tournament table until it is the turn of a human
+   Args:
+       No args
+   Returns:
+       name of the bot who won the Game or None
+   """
+    if g.tournament is None:
+        return None
+    # imported here, tournament.py imports this module
+    import tournament
+
+    while g.tournament.is_bot(name):
+        i = [player.name for player in g.players].index(name)
+        if len(deck.cards) == 0:
+            g.reshuffle_pile()
+        if tournament.bot_turn(g, g.players[i], g.advisors.setdefault(name, DiscardAdvisor())):
+            return name
+        g.play((i + 1) % len(g.players))
+    # The bots may have put sets on the table or added cards to them
+    len_run[:] = [len(cards) for cards in table_stash]
+    return None
+
+
+def finish_game(winner):
+    """ Record the winner of the Game, and report it to the Tournament of a tournament table
+   Args:
+       winner: name of the Player who won the Game
+   Returns:
+       No returns
+   """
+    first = not g.finished
+    g.save_record(winner)
+    if first and g.tournament is not None:
+        import tournament
+        g.tournament.add_result(tournament.TableResult(g.tournament_table, [player.name for player in g.players],
+                                                       winner, g.record['turns']))
+
+
+@app.route("/take_card", methods=['GET','POST'])
+def main():
+    """ Main Program """
+    #return render_template('play_game.htm')
+    start_game()
+
+    return render_game('take_a_card.htm', table_stash=table_stash, name=name, self_stash=self_stash,
                            len_table_stash=len_table_stash, len_self_stash=len_self_stash, pile=self_pile[0])
 
     # return render_template('play_game.htm')
@@ -602,7 +1188,9 @@ def take_card():
     if take == 'P' or take == 'p':
         if len(self_stash) < 14:
             c = g.draw_pile()
+            g.record['pile_draws'] += 1
             self_stash.insert(len(self_stash),c)
+            g.bump_version()
 
         else:
             input("ERROR: You have " + str(len(self_stash)) + " cards. Cannot pick anymore. Enter to continue")
@@ -612,6 +1200,8 @@ def take_card():
         if len(self_stash) < 14:
             c = deck.draw_card()
             self_stash.insert(len(self_stash), c)
+            g.record['deck_draws'] += 1
+            g.bump_version()
         else:
             input("ERROR: You have " + str(len(self.stash)) + " cards. Cannot take anymore. Enter to continue")
 
@@ -623,7 +1213,7 @@ def take_card():
         pile = self_pile[0]
 
 
-    return render_template('play_game.htm', self_stash=self_stash, name=name, hand=hand, new_table_stash = new_table_stash,
+    return render_game('play_game.htm', self_stash=self_stash, name=name, hand=hand, new_table_stash = new_table_stash,
                            len_new_table_stash=len_new_table_stash, len_hand=len_hand, pile=pile, len_run=len_run)
 
 
@@ -663,7 +1253,7 @@ def action():
 
 
 
-                if (is_valid_run(cards) or is_valid_book(cards)):
+                if (is_valid_run_joker(cards) or is_valid_book(cards)):
                     counter = len(cards)
                     check = list(table_stash[number])
 
@@ -672,7 +1262,8 @@ def action():
                             check.remove(cards[i])
 
 
-                    if (is_valid_run(check) or is_valid_book(check) or len(check)==0):
+                    if (is_valid_run_joker(check) or is_valid_book(check) or len(check)==0):
+                        g.record_meld(cards)
                         len_run.append(len(cards))
                         table_stash.append(cards)
                         for i in range(0, counter):
@@ -682,15 +1273,20 @@ def action():
                             if cards[i] in self_stash:
                                 self_stash.remove(cards[i])
                                 counter -= 1
+                        g.bump_version()
 
 
         # Sort cards in the stash
         if action == 'S' or action == 's':
+            order = list(self_stash)
             sort_sequence(self_stash)
+            if self_stash != order:
+                g.bump_version()
 
         #Drop card to Pile
         if action == 'D' or action == 'd':
             if len(self_stash)==1:
+                finish_game(name)
                 return render_template('winner.htm', name=name)
 
 
@@ -708,6 +1304,7 @@ def action():
             if drop != "":
                 self_stash.remove(drop)
                 g.add_pile(drop)
+                g.record['turns'] += 1
 
                 for i in range(0, int(number_of_people)):
                     if g.players[i].name == name:
@@ -719,6 +1316,11 @@ def action():
                             break
                         break
 
+                # At a tournament table the bots play until it is the turn of a human
+                winner = play_bot_turns()
+                if winner:
+                    finish_game(winner)
+                    return render_template('winner.htm', name=winner)
 
                 hand = self_stash
                 len_hand = len(hand)
@@ -726,7 +1328,7 @@ def action():
                 new_table_stash = table_stash
                 len_new_table_stash = len(new_table_stash)
 
-            return render_template('take_a_card2.htm', new_table_stash=new_table_stash, name=name, hand=hand,
+            return render_game('take_a_card2.htm', new_table_stash=new_table_stash, name=name, hand=hand,
                                len_new_table_stash=len_new_table_stash, len_hand=len_hand, pile=self_pile[0], len_run=len_run)
 
 
@@ -743,9 +1345,10 @@ def action():
                         what = get_object(self_stash, what.upper())
                         cards.append(what)
 
-                if (is_valid_run(cards) or is_valid_book(cards)):
+                if (is_valid_run_joker(cards) or is_valid_book(cards)):
                     # print("valid")
                     # print run
+                    g.record_meld(cards)
                     len_run.append(len(cards))
                     table_stash.append(cards)
                     counter = len(cards)
@@ -753,6 +1356,7 @@ def action():
                         if cards[i] in self_stash:
                             self_stash.remove(cards[i])
                             counter -= 1
+                    g.bump_version()
 
 
 
@@ -803,12 +1407,95 @@ def action():
         len_new_table_stash = len(new_table_stash)
 
 
-        return render_template('play_game.htm', new_table_stash=new_table_stash, name=name, hand=hand,
+        return render_game('play_game.htm', new_table_stash=new_table_stash, name=name, hand=hand,
                                len_new_table_stash=len_new_table_stash, len_hand=len_hand, pile=pile, len_run=len_run)
 
+@app.route("/discard_advice")
+def discard_advice():
+    advisor = g.advisors.setdefault(name, DiscardAdvisor())
+    # Nothing changed since the last call - do not count the unseen cards again
+    if advisor.version == g.version:
+        advice = advisor.advice
+    else:
+        unseen = unseen_cards(deck.packs, self_stash, self_pile, table_stash)
+        if deck.joker:
+            unseen[card_kind(deck.joker)] -= 1
+        advice = advisor.rank_discards(self_stash, unseen, g.version)
+    return jsonify([{'card': card, 'outs': outs} for card, outs in advice])
+
+@app.route("/wait_turn")
+def wait_turn():
+    version = request.args.get('version', type=int)
+    with turn_changed:
+        turn_changed.wait_for(lambda: g.version != version, timeout=WAIT_TIMEOUT)
+    return jsonify({'version': g.version, 'name': name})
+
+@app.route("/spectate")
+def spectate():
+    game_id = request.args.get('game')
+    if game_id is None:
+        game_id = g.id
+    snapshot = find_snapshot(game_id)
+    if snapshot is None:
+        return jsonify({'error': 'no such game'}), 404
+
+    version, snapshot = snapshot
+    response = make_response(snapshot)
+    response.mimetype = 'application/json'
+    response.set_etag('%s-%s' % (game_id, version))
+    return response.make_conditional(request)
+
+@app.route("/live_games")
+def list_live_games():
+    return jsonify(sorted(set(live_games.keys()) | set(published_games())))
+
+@app.route("/cache_stats")
+def cache_stats():
+    return jsonify(render_cache.stats())
+
+@app.route("/tournament", methods=['GET', 'POST'])
+def tournament_status():
+    global current_tournament
+    if request.method == 'POST':
+        import tournament
+        if current_tournament is not None and (current_tournament.running or current_tournament.human_tables):
+            return jsonify({'error': 'a tournament is not finished'}), 409
+
+        bots = [n.strip() for n in request.form.get('bots', '').split(',') if n.strip()]
+        humans = [n.strip() for n in request.form.get('humans', '').split(',') if n.strip()]
+        table_size = request.form.get('table_size', 2, type=int)
+        entrants = [tournament.Entrant(n, True) for n in bots] + [tournament.Entrant(n, False) for n in humans]
+        if table_size < 2 or len(entrants) < table_size or len(set(bots + humans)) != len(entrants):
+            return jsonify({'error': 'need at least table_size players with different names'}), 400
+
+        current_tournament = tournament.Tournament(entrants, table_size, bool(request.form.get('bracket')),
+                                                   spectate_dir=SPECTATE_DIR)
+        current_tournament.start()
+
+    if current_tournament is None:
+        return jsonify({'error': 'no tournament'}), 404
+    return jsonify(current_tournament.status())
+
+@app.route("/tournament/play/<int:table_id>", methods=['GET', 'POST'])
+def play_tournament_table(table_id):
+    names = current_tournament.human_tables.get(table_id) if current_tournament is not None else None
+    if names is None:
+        return jsonify({'error': 'no such table'}), 404
+
+    start_game(names, table_id)
+    winner = play_bot_turns()
+    if winner:
+        finish_game(winner)
+        return render_template('winner.htm', name=winner)
+
+    return render_game('take_a_card.htm', table_stash=table_stash, name=name, self_stash=self_stash,
+                       len_table_stash=len_table_stash, len_self_stash=len_self_stash, pile=self_pile[0])
+
 #@app.route("/game", methods=['GET','POST'])
 #def start_the_game():
 #    main()
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5011, debug=True)
+    # Serve the routes of the game module, the state tournament.py and asgi.py share, not of __main__
+    import game
+    game.app.run(host="0.0.0.0", port=5011, debug=True)
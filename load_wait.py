@@ -0,0 +1,114 @@
+#coding=utf-8
+import argparse
+import asyncio
+import json
+import time
+from urllib.request import urlopen
+
+"""
+Load test of idle players waiting in /wait_turn, to compare the serving modes.
+
+Start a game in the browser first, then run the server in one of the modes:
+    python game.py                                   (threaded)
+    uvicorn asgi:app --host 0.0.0.0 --port 5011      (asyncio)
+and keep N clients waiting while timing a normal request:
+    python load_wait.py --clients 2000 --pid <server pid>
+
+With --pid the threads and memory of the server process are read from /proc.
+Raise the open files limit (ulimit -n) of both processes for many clients.
+"""
+
+
+def get_json(url):
+    """ Get a JSON response
+   Args:
+       url: address to get
+   Returns:
+       the decoded JSON value
+   """
+    with urlopen(url) as response:
+        return json.loads(response.read().decode('utf-8'))
+
+
+def process_status(pid):
+    """ Read the number of threads and the memory of a process
+   Args:
+       pid: process id - int value
+   Returns:
+       (threads, memory in kB) tuple
+   """
+    status = {}
+    with open('/proc/%d/status' % pid) as f:
+        for line in f:
+            key, value = line.split(':', 1)
+            if value.split():
+                status[key] = value.split()[0]
+    return int(status['Threads']), int(status['VmRSS'])
+
+
+async def idle_client(host, port, version, results):
+    """ Wait in /wait_turn until the Game changes or the server times out
+   Args:
+       host, port: address of the server
+       version: version of the Game to wait on - int value
+       results: dict of counters
+   Returns:
+       No returns
+   """
+    try:
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.write(('GET /wait_turn?version=%d HTTP/1.1\r\nHost: %s\r\nConnection: close\r\n\r\n'
+                      % (version, host)).encode())
+        await writer.drain()
+        results['connected'] += 1
+        await reader.read()
+        results['answered'] += 1
+        writer.close()
+    except OSError:
+        results['errors'] += 1
+
+
+async def run(host, port, clients, hold, pid):
+    """ Keep the clients waiting, then time a request and report
+   Args:
+       host, port: address of the server
+       clients: number of waiting clients - int value
+       hold: seconds to wait before timing the request
+       pid: process id of the server or None
+   Returns:
+       report string
+   """
+    base = 'http://%s:%d' % (host, port)
+    loop = asyncio.get_running_loop()
+    version = (await loop.run_in_executor(None, get_json, base + '/wait_turn?version=-1'))['version']
+
+    results = {'connected': 0, 'answered': 0, 'errors': 0}
+    tasks = [asyncio.ensure_future(idle_client(host, port, version, results)) for i in range(clients)]
+    await asyncio.sleep(hold)
+
+    probe = time.time()
+    await loop.run_in_executor(None, get_json, base + '/cache_stats')
+    probe = time.time() - probe
+
+    s = "Clients: %d, connected: %d, answered early: %d, errors: %d" % (
+        clients, results['connected'], results['answered'], results['errors'])
+    s += "\n/cache_stats took %.1f ms after %.1f s of waiting" % (probe * 1000, hold)
+    if pid:
+        threads, memory = process_status(pid)
+        s += "\nServer threads: %d, memory: %d kB" % (threads, memory)
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return s
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Idle /wait_turn clients against a game server.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5011)
+    parser.add_argument('--clients', type=int, default=1000, help='number of waiting clients')
+    parser.add_argument('--hold', type=float, default=5.0, help='seconds to keep the clients waiting before timing')
+    parser.add_argument('--pid', type=int, default=None, help='process id of the server, to report threads and memory')
+    args = parser.parse_args()
+    print(asyncio.run(run(args.host, args.port, args.clients, args.hold, args.pid)))
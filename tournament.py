@@ -0,0 +1,499 @@
+#coding=utf-8
+import argparse
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from itertools import combinations
+from multiprocessing import get_context
+
+import game
+from game import Deck, Table, Game, DiscardAdvisor, RANK, SUIT, card_kind, solve_meld, unseen_cards
+
+"""
+Tournament mode.
+
+Registered players are put at tables of a round robin (every pair of players once)
+or of a bracket (winners go to the next round).  Tables with bots only are played
+through the Game engine by a pool of worker processes, one less than the number of
+CPUs so interactive requests still get a core, run from a background thread.
+Tables with a human are played through the web pages of game.py (/tournament),
+which report the winner with Tournament.add_result().  Results go to the
+standings in batches.
+
+Usage: python tournament.py --bots Bot1 Bot2 Bot3 Bot4 [--bracket]
+"""
+MAX_TURNS = 1000
+BATCH_SIZE = 16
+
+
+class Entrant:
+    """ Entrant Class - Models a player registered in the Tournament """
+
+    def __init__(self, name, bot):
+        """ Class Constructor
+      Args:
+          name: Name of the player - string
+          bot: True if the player is played by the computer
+      Returns:
+          No return value
+      """
+        self.name = name
+        self.bot = bot
+        self.played = 0
+        self.won = 0
+
+
+class TableResult:
+    """ TableResult Class - Result of one table of the Tournament """
+
+    def __init__(self, table_id, names, winner, turns):
+        """ Class Constructor
+      Args:
+          table_id: number of the table - int value
+          names: names of the players at the table
+          winner: name of the winner
+          turns: number of turns played
+      Returns:
+          No return value
+      """
+        self.table_id = table_id
+        self.names = names
+        self.winner = winner
+        self.turns = turns
+
+
+def find_meld(stash):
+    """ Find a set in the hand of a bot, books first and then runs.
+   Jokers are not used, as in the web game.
+   Args:
+       stash: array of Card objects
+   Returns:
+       array of Card objects or None
+   """
+    by_rank = {}
+    by_suit = {}
+    for card in stash:
+        by_rank.setdefault(card.rank, OrderedDict()).setdefault(card.suit, card)
+        values = by_suit.setdefault(card.suit, {})
+        value = RANK.index(card.rank) + 1
+        values.setdefault(value, card)
+        if card.rank == 'A':
+            values.setdefault(14, card)
+
+    for rank in RANK:
+        cards = list(by_rank.get(rank, {}).values())
+        if len(cards) >= 3:
+            return cards
+
+    for suit in SUIT:
+        values = by_suit.get(suit, {})
+        run = []
+        for value in range(1, 16):
+            if value in values and values[value] not in run:
+                run.append(values[value])
+            elif len(run) >= 3:
+                return run
+            else:
+                run = [values[value]] if value in values else []
+    return None
+
+
+def lay_off(g, player):
+    """ Add cards of a bot to the sets on the table, like the Move action of the web game.
+   A card is kept in the hand to drop.
+   Args:
+       g: the Game being played
+       player: the Player whose turn it is
+   Returns:
+       No returns
+   """
+    for card in list(player.stash):
+        if len(player.stash) == 1:
+            return
+        for cards in g.table.stash:
+            if solve_meld(cards + [card]) is not None:
+                cards.append(card)
+                player.stash.remove(card)
+                g.bump_version()
+                break
+
+
+def bot_turn(g, player, advisor):
+    """ Play a single turn of a bot: draw, put sets on the table, add cards to them and drop a card.
+   Args:
+       g: the Game being played
+       player: the Player whose turn it is
+       advisor: DiscardAdvisor of the Player
+   Returns:
+       True if the Player won the Game
+   """
+    # Take the pile card if it completes a set, otherwise take from the deck
+    g.turn = player.name
+    advisor.sync(player.stash)
+    if game.self_pile and advisor.completions[card_kind(game.self_pile[0])] > 0:
+        player.deal_card(g.draw_pile())
+        g.record['pile_draws'] += 1
+        g.bump_version()
+    else:
+        player.deal_card(g.deck.draw_card())
+        g.record['deck_draws'] += 1
+        g.bump_version()
+
+    meld = find_meld(player.stash)
+    while meld:
+        # Keep a card to drop
+        meld = meld[:len(player.stash) - 1]
+        if len(meld) < 3 or solve_meld(meld) is None:
+            break
+        g.record_meld(meld)
+        g.table.stash.append(meld)
+        for card in meld:
+            player.stash.remove(card)
+        g.bump_version()
+        meld = find_meld(player.stash)
+    lay_off(g, player)
+
+    if len(player.stash) == 1:
+        return True
+
+    unseen = unseen_cards(g.deck.packs, player.stash, game.self_pile, g.table.stash)
+    advice = advisor.rank_discards(player.stash, unseen, None)
+    player.drop_card(advice[0][0][:2])
+    g.record['turns'] += 1
+    return False
+
+
+def play_bot_table(table):
+    """ Play a whole Game at a table of bots
+   Args:
+       table: (table id, names of the players, random seed, directory for spectator snapshots or None) tuple
+   Returns:
+       TableResult
+   """
+    table_id, names, seed, spectate_dir = table
+    random.seed(seed)
+
+    # The Pile is shared by the module, a worker plays one Game at a time
+    del game.self_pile[:]
+
+    deck = Deck(len(names))
+    deck.shuffle()
+    g = Game(len(names), deck, Table(), names)
+    for i in range(13):
+        for player in g.players:
+            player.deal_card(deck.draw_card())
+    g.add_pile(deck.draw_card())
+
+    advisors = [DiscardAdvisor() for player in g.players]
+    i = 0
+    turns = 0
+    winner = None
+    while turns < MAX_TURNS:
+        if len(deck.cards) == 0:
+            g.reshuffle_pile()
+            if len(deck.cards) == 0:
+                break
+        won = bot_turn(g, g.players[i], advisors[i])
+        turns += 1
+        if spectate_dir:
+            g.publish_snapshot(spectate_dir)
+        if won:
+            winner = g.players[i]
+            break
+        i = (i + 1) % len(g.players)
+
+    if winner is None:
+        # Nobody closed the game - the player with the fewest cards wins, the first of them in turn order on a tie
+        winner = min(g.players, key=lambda player: len(player.stash))
+    else:
+        # Only closed games go to the records, as in the web game
+        g.save_record(winner.name)
+    if spectate_dir:
+        g.unpublish_snapshot(spectate_dir)
+    return TableResult(table_id, names, winner.name, turns)
+
+
+def init_worker():
+    """ Lower the priority of the worker processes, so the web game stays responsive
+   Args:
+       No args
+   Returns:
+       No returns
+   """
+    if hasattr(os, 'nice'):
+        os.nice(5)
+
+
+class Tournament:
+    """ Tournament Class - Schedules the tables and keeps the standings """
+
+    def __init__(self, entrants, table_size=2, bracket=False, processes=None, spectate_dir=None):
+        """ Class Constructor
+      Args:
+          entrants: array of Entrant objects
+          table_size: number of players at a table - int value
+          bracket: True for a bracket, False for a round robin
+          processes: number of worker processes, one less than the CPUs if None
+          spectate_dir: directory where the bot tables write their snapshots for /spectate, None for no snapshots
+      Returns:
+          No return value
+      """
+        self.entrants = OrderedDict((entrant.name, entrant) for entrant in entrants)
+        self.table_size = table_size
+        self.bracket = bracket
+        self.processes = processes or max(1, (os.cpu_count() or 2) - 1)
+        self.spectate_dir = spectate_dir
+        if spectate_dir:
+            os.makedirs(spectate_dir, exist_ok=True)
+        self.table_count = 0
+        self.human_tables = {}  # table id -> names, waiting for add_result
+        self.rounds = 0  # number of rounds started
+        self.round = []  # names of the players in the current round
+        self.round_tables = 0  # number of tables in the current round
+        self.round_results = []
+        self.results = []
+        self.pending = []  # results not in the standings yet
+        self.elapsed = 0.0
+        # Results come from the scheduler thread and from the web requests of human tables
+        self.lock = threading.RLock()
+        self.running = False
+        self.thread = None
+
+    def is_bot(self, name):
+        """ Check if a player of the Tournament is played by the computer
+      Args:
+          name: name of the player
+      Returns:
+          True or False
+      """
+        entrant = self.entrants.get(name)
+        return entrant is not None and entrant.bot
+
+    def make_tables(self, names):
+        """ Create the tables of a round
+      Args:
+          names: names of the players in the round
+      Returns:
+          array of (table id, names, seed, spectate_dir) tuples
+      """
+        if self.bracket:
+            groups = [names[i:i + self.table_size] for i in range(0, len(names), self.table_size)]
+            groups = [group for group in groups if len(group) > 1]
+        else:
+            groups = list(combinations(names, self.table_size))
+
+        tables = []
+        for group in groups:
+            self.table_count += 1
+            tables.append((self.table_count, list(group), random.randrange(1 << 32), self.spectate_dir))
+        return tables
+
+    def add_result(self, result):
+        """ Add the result of a table, the standings are updated once a batch is complete.
+      The result of the last table of a bracket round starts the next round in the background.
+      Args:
+          result: TableResult
+      Returns:
+          No returns
+      """
+        with self.lock:
+            self.human_tables.pop(result.table_id, None)
+            self.results.append(result)
+            self.round_results.append(result)
+            self.pending.append(result)
+            if len(self.pending) >= BATCH_SIZE:
+                self.update_standings()
+            if self.bracket and self.round_complete():
+                self.start()
+
+    def round_complete(self):
+        """ Check if all the tables of the current round have a result
+      Args:
+          No args
+      Returns:
+          True or False
+      """
+        return self.round_tables > 0 and len(self.round_results) == self.round_tables
+
+    def next_round(self):
+        """ Names of the players going to the next bracket round: the winners and a player left alone
+      Args:
+          No args
+      Returns:
+          array of names
+      """
+        names = [result.winner for result in sorted(self.round_results, key=lambda result: result.table_id)]
+        if len(self.round) % self.table_size == 1:
+            names += self.round[-1:]
+        return names
+
+    def champion(self):
+        """ Winner of a finished bracket
+      Args:
+          No args
+      Returns:
+          name of the winner or None
+      """
+        if self.bracket and self.round_complete() and len(self.next_round()) == 1:
+            return self.next_round()[0]
+        return None
+
+    def update_standings(self):
+        """ Put the pending results into the standings
+      Args:
+          No args
+      Returns:
+          No returns
+      """
+        with self.lock:
+            for result in self.pending:
+                for player_name in result.names:
+                    self.entrants[player_name].played += 1
+                if result.winner:
+                    self.entrants[result.winner].won += 1
+            self.pending = []
+
+    def start_round(self):
+        """ Create the tables of the next round, the lock must be held
+      Args:
+          No args
+      Returns:
+          array of the bot tables to play, or None if there is no round to start now
+      """
+        if self.rounds == 0:
+            names = list(self.entrants)
+            if self.bracket:
+                random.shuffle(names)
+        elif self.bracket and self.round_complete() and len(self.next_round()) > 1:
+            names = self.next_round()
+            random.shuffle(names)
+        else:
+            return None
+
+        tables = self.make_tables(names)
+        self.rounds += 1
+        self.round = names
+        self.round_tables = len(tables)
+        self.round_results = []
+
+        bot_tables = []
+        for table in tables:
+            if all(self.is_bot(player_name) for player_name in table[1]):
+                bot_tables.append(table)
+            else:
+                self.human_tables[table[0]] = table[1]
+        return bot_tables
+
+    def start(self):
+        """ Play the bot tables in a background thread, so the web requests are not kept waiting
+      Args:
+          No args
+      Returns:
+          No returns
+      """
+        with self.lock:
+            if self.running:
+                return
+            self.running = True
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def run(self):
+        """ Play the rounds of the Tournament until a round waits for human tables or the Tournament ends.
+      Bot tables go to a pool of worker processes.  Use start() to run it in the background.
+      Args:
+          No args
+      Returns:
+          No returns
+      """
+        start = time.time()
+        pool = None
+        try:
+            while True:
+                with self.lock:
+                    bot_tables = self.start_round()
+                    if bot_tables is None:
+                        break
+                if not bot_tables:
+                    continue
+                if pool is None:
+                    # Worker processes are spawned, forking the threads of the web server is not safe
+                    pool = get_context('spawn').Pool(self.processes, initializer=init_worker)
+                for result in pool.imap_unordered(play_bot_table, bot_tables):
+                    self.add_result(result)
+        finally:
+            # A failed round does not keep the Tournament from being started again
+            with self.lock:
+                self.running = False
+            if pool is not None:
+                pool.terminate()
+        self.update_standings()
+        self.elapsed += time.time() - start
+
+    def standings(self):
+        """ Standings of the Tournament
+      Args:
+          No args
+      Returns:
+          array of Entrant objects, best first
+      """
+        return sorted(self.entrants.values(), key=lambda entrant: (-entrant.won, entrant.played))
+
+    def status(self):
+        """ State of the Tournament for the /tournament page
+      Args:
+          No args
+      Returns:
+          dict of the standings, the tables waiting for humans and the scheduling throughput
+      """
+        with self.lock:
+            return {'running': self.running,
+                    'rounds': self.rounds,
+                    'tables_played': len(self.results),
+                    'seconds': round(self.elapsed, 2),
+                    'tables_per_second': round(len(self.results) / self.elapsed, 1) if self.elapsed else None,
+                    'human_tables': [{'table': table_id, 'players': names, 'play': '/tournament/play/%d' % table_id}
+                                     for table_id, names in self.human_tables.items()],
+                    'winner': self.champion(),
+                    'standings': [{'name': entrant.name, 'won': entrant.won, 'played': entrant.played}
+                                  for entrant in self.standings()]}
+
+    def report(self):
+        """ Make a displayable report of the standings and the scheduling throughput
+      Args:
+          No args
+      Returns:
+          report string
+      """
+        s = "Tables played: %d in %.2f s" % (len(self.results), self.elapsed)
+        if self.elapsed:
+            s += " (%.1f tables/s, %d processes)" % (len(self.results) / self.elapsed, self.processes)
+        turns = sum(result.turns for result in self.results)
+        if self.elapsed:
+            s += "\nTurns played: %d (%.1f turns/s)" % (turns, turns / self.elapsed)
+        if self.champion():
+            s += "\nBracket winner: %s" % self.champion()
+        s += "\nStandings:"
+        for place, entrant in enumerate(self.standings()):
+            s += "\n%3d. %-20s won %d of %d" % (place + 1, entrant.name, entrant.won, entrant.played)
+        return s
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Rummy tournament of bots.  Tournaments with human players '
+                                                 'are started from /tournament of the web server.')
+    parser.add_argument('--bots', nargs='*', default=[], help='names of the bot players')
+    parser.add_argument('--table-size', type=int, default=2, help='number of players at a table')
+    parser.add_argument('--bracket', action='store_true', help='play a bracket instead of a round robin')
+    parser.add_argument('--processes', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--spectate-dir', default=None,
+                        help='write snapshots of the bot tables here, use game.SPECTATE_DIR to watch them in /spectate')
+    args = parser.parse_args()
+
+    tournament = Tournament([Entrant(n, True) for n in args.bots], args.table_size, args.bracket, args.processes,
+                            args.spectate_dir)
+    tournament.start()
+    tournament.thread.join()
+    print(tournament.report())